@@ -79,7 +79,7 @@ parser.add_argument(
 )
 args = parser.parse_args()
 
-script_start = time.time()
+script_start = time.perf_counter()
 
 tc_build_folder = Path(__file__).resolve().parent
 
@@ -1,9 +1,41 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from pathlib import Path
 import shlex
 import shutil
 import subprocess
+import threading
+
+import tc_build.utils
+
+# Commands from run_cmd() that are still running, so that they can be stopped
+# when a build running in parallel with them fails.
+_processes: set[subprocess.Popen] = set()
+_processes_lock = threading.Lock()
+_stopping = threading.Event()
+
+
+def run_parallel(func, items, max_workers=None):
+    # Call func on each item in parallel. If one of the calls fails, stop the
+    # others right away rather than waiting for them to finish, which could
+    # take hours, before surfacing the failure.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        wait(futures, return_when=FIRST_EXCEPTION)
+        if not (failed := [future for future in futures if future.done() and future.exception()]):
+            return
+        tc_build.utils.print_warning('A build failed, stopping the builds running alongside it...')
+        # When nested, the outermost call is responsible for stopping everything
+        owner = not _stopping.is_set()
+        _stopping.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        with _processes_lock:
+            for proc in _processes:
+                proc.terminate()
+    if owner:
+        _stopping.clear()
+    failed[0].result()
 
 
 class Folders:
@@ -15,6 +47,7 @@ class Folders:
 
 class Builder:
     def __init__(self):
+        self.build_jobs: int | None = None
         self.folders = Folders()
         self.show_commands = False
 
@@ -31,8 +64,29 @@ class Builder:
             else:
                 self.folders.build.unlink()
 
-    def run_cmd(self, cmd, capture_output=False, cwd=None):
+    def run_cmd(self, cmd, capture_output=False, cwd=None, stdout=None, stderr=None):
         if self.show_commands:
             # Acts sort of like 'set -x' in bash
             print(f"$ {' '.join([shlex.quote(str(elem)) for elem in cmd])}", flush=True)
-        return subprocess.run(cmd, capture_output=capture_output, check=True, cwd=cwd)
+        if capture_output:
+            stdout = stderr = subprocess.PIPE
+        with _processes_lock:
+            if _stopping.is_set():
+                raise RuntimeError('Not running command, as a parallel build failed!')
+            proc = subprocess.Popen(
+                cmd,
+                close_fds=tc_build.utils.DEFAULT_CLOSE_FDS,
+                cwd=cwd,
+                stderr=stderr,
+                stdout=stdout,
+            )
+            _processes.add(proc)
+        try:
+            with proc:
+                out, err = proc.communicate()
+        finally:
+            with _processes_lock:
+                _processes.discard(proc)
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, out, err)
+        return subprocess.CompletedProcess(cmd, proc.returncode, out, err)
@@ -7,7 +7,7 @@ import subprocess
 from tempfile import NamedTemporaryFile
 import time
 
-from tc_build.builder import Builder
+from tc_build.builder import Builder, run_parallel
 from tc_build.source import SourceManager
 import tc_build.utils
 
@@ -98,7 +98,8 @@ class KernelBuilder(Builder):
                 '--output', self.bolt_sampling_output,
                 '--',
             ]  # yapf: disable
-        make_cmd += ['make', '-C', self.folders.source, f"-skj{os.cpu_count()}"]
+        jobs = self.build_jobs or tc_build.utils.cpu_count()
+        make_cmd += ['make', '-C', self.folders.source, f"-skj{jobs}"]
         make_cmd += [f"{key}={self.make_variables[key]}" for key in sorted(self.make_variables)]
         make_cmd += [*self.config_targets, 'all']
 
@@ -106,7 +107,7 @@ class KernelBuilder(Builder):
         # Ideally, the kernel would always clobber user flags via ':=' but we deal with reality.
         os.environ.pop('CFLAGS', '')
 
-        build_start = time.time()
+        build_start = time.perf_counter()
         try:
             self.run_cmd(make_cmd)
         finally:
@@ -342,6 +343,9 @@ class LLVMKernelBuilder(Builder):
         self.bolt_instrumentation = False
         self.bolt_sampling_output = None
         self.matrix = {}
+        # Number of kernels to build at the same time, each in its own build
+        # folder with an equal share of the available CPUs.
+        self.parallel_builds = 1
         self.toolchain_prefix: Path | None = None
 
     def build(self):
@@ -402,10 +406,29 @@ class LLVMKernelBuilder(Builder):
         for builder in builders:
             builder.bolt_instrumentation = self.bolt_instrumentation
             builder.bolt_sampling_output = self.bolt_sampling_output
+            builder.build_jobs = self.build_jobs
             builder.folders.build = self.folders.build
             builder.folders.source = self.folders.source
             builder.toolchain_prefix = self.toolchain_prefix
-            builder.build()
+
+        # perf cannot record multiple builds to the same output
+        workers = min(self.parallel_builds, len(builders))
+        if workers > 1 and not self.bolt_sampling_output:
+            available_jobs = self.build_jobs or tc_build.utils.cpu_count()
+            build_jobs = max(1, available_jobs // workers)
+            for idx, builder in enumerate(builders):
+                builder.build_jobs = build_jobs
+                builder.folders.build = Path(self.folders.build, str(idx))
+            run_parallel(self.build_and_clean, builders, max_workers=workers)
+        else:
+            for builder in builders:
+                builder.build()
+
+    def build_and_clean(self, builder):
+        builder.build()
+        # Only the build in the main build folder is left behind in the serial
+        # case, do not use more space than that in total.
+        builder.clean_build_folder()
 
 
 class LinuxSourceManager(SourceManager):
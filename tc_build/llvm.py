@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 import contextlib
+import functools
+import hashlib
 import os
 from pathlib import Path
 import platform
@@ -13,12 +15,39 @@ from tc_build.builder import Builder
 from tc_build.tools import Tools
 import tc_build.utils
 
+# These only size the compile and link job pools, which do not affect the
+# output of the build, so they should not invalidate existing build folders.
+JOB_POOL_DEFINES_PREFIX = 'LLVM_PARALLEL_'
 
+
+# The source tree does not change while the script runs, so only parse it once
+# per tree, as this is needed for every configuration and the default targets.
+@functools.lru_cache(maxsize=None)
 def get_all_targets(llvm_folder):
     contents = Path(llvm_folder, 'llvm/CMakeLists.txt').read_text(encoding='utf-8')
     if not (match := re.search(r'set\(LLVM_ALL_TARGETS([\w|\s]+)\)', contents)):
         raise RuntimeError('Could not find LLVM_ALL_TARGETS?')
-    return [val for target in match.group(1).splitlines() if (val := target.strip())]
+    return tuple(val for target in match.group(1).splitlines() if (val := target.strip()))
+
+
+def can_use_perf():
+    # Make sure perf is in the environment
+    if shutil.which('perf'):
+        try:
+            perf_cmd = [
+                'perf', 'record',
+                '--branch-filter', 'any,u',
+                '--event', 'cycles:u',
+                '--output', '/dev/null',
+                '--', 'sleep', '1',
+            ]  # yapf: disable
+            subprocess.run(perf_cmd, capture_output=True, check=True)
+        except subprocess.CalledProcessError:
+            pass  # Fallthrough to False below
+        else:
+            return True
+
+    return False
 
 
 class LLVMBuilder(Builder):
@@ -27,17 +56,35 @@ class LLVMBuilder(Builder):
 
         self.bolt = False
         self.bolt_builder: Builder | None = None
+        self.bolt_use_perf: bool | None = None
+        self.force_bolt = False
         self.build_targets = ['all']
-        self.ccache = False
+        self.compiler_launcher: str | None = None
         self.check_targets = []
         self.cmake_defines = {}
+        self.incremental = False
         self.install_targets = []
         self.tools: Tools | None = None
         self.projects = []
         self.quiet_cmake = False
         self.targets = []
 
+    @property
+    def bolt_stamp(self):
+        return Path(self.folders.build, '.bolt-stamp')
+
     def bolt_clang(self):
+        clang = Path(self.folders.build, 'bin/clang').resolve()
+
+        # If the build folder was reused and ninja did not relink clang, it is
+        # the binary that was already optimized by BOLT, which should not be
+        # optimized again.
+        if self.bolt_stamp.exists() and self.bolt_stamp.read_text(
+            encoding='utf-8'
+        ) == tc_build.utils.file_digest(clang):
+            tc_build.utils.print_info('clang has already been optimized with BOLT, skipping...')
+            return
+
         # Default to instrumentation, as it should be universally available.
         mode = 'instrumentation'
         # If we can use perf for branch sampling, we switch to that mode, as
@@ -50,12 +97,18 @@ class LLVMBuilder(Builder):
         # clang-#: original binary
         # clang.bolt: BOLT optimized binary
         # .bolt will become original binary after optimization
-        clang = Path(self.folders.build, 'bin/clang').resolve()
         clang_bolt = clang.with_name('clang.bolt')
 
         bolt_profile = Path(self.folders.build, 'clang.fdata')
+        fdata_glob = f"{bolt_profile.name}.*.fdata"
 
         if mode == 'instrumentation':
+            # The final build folder may have been reused from a previous run,
+            # whose profiles refer to a different binary and should not end up
+            # in the new profile.
+            for fdata_file in bolt_profile.parent.glob(fdata_glob):
+                fdata_file.unlink()
+
             # clang.inst: instrumented binary, will be removed after generating profiles
             clang_inst = clang.with_name('clang.inst')
 
@@ -81,7 +134,7 @@ class LLVMBuilder(Builder):
         # With instrumentation, we need to combine the profiles we generated,
         # as they are separated by PID
         if mode == 'instrumentation':
-            fdata_files = bolt_profile.parent.glob(f"{bolt_profile.name}.*.fdata")
+            fdata_files = list(bolt_profile.parent.glob(fdata_glob))
 
             # merge-fdata will print one line for each .fdata it merges.
             # Redirect the output to a log file in case it ever needs to be
@@ -93,7 +146,7 @@ class LLVMBuilder(Builder):
             ) as err_file:
                 tc_build.utils.print_info('Merging .fdata files, this might take a while...')
                 subprocess.run(
-                    [self.tools.merge_fdata, *list(fdata_files)],
+                    [self.tools.merge_fdata, *fdata_files],
                     check=True,
                     stderr=err_file,
                     stdout=out_file,
@@ -136,6 +189,8 @@ class LLVMBuilder(Builder):
         if mode == 'instrumentation':
             clang_inst.unlink()
 
+        self.bolt_stamp.write_text(tc_build.utils.file_digest(clang), encoding='utf-8')
+
     def build(self):
         if not self.folders.build:
             raise RuntimeError('No build folder set for build()?')
@@ -144,8 +199,17 @@ class LLVMBuilder(Builder):
         if self.bolt and not self.bolt_builder:
             raise RuntimeError('BOLT requested without a builder?')
 
-        build_start = time.time()
+        # llvm-bolt refuses to optimize a binary that it has already
+        # optimized, so remove it to have ninja relink the original.
+        if self.bolt and self.force_bolt:
+            clang = Path(self.folders.build, 'bin/clang')
+            if clang.exists():
+                clang.resolve().unlink()
+
+        build_start = time.perf_counter()
         base_ninja_cmd = ['ninja', '-C', self.folders.build]
+        if self.build_jobs:
+            base_ninja_cmd.append(f"-j{self.build_jobs}")
         self.run_cmd([*base_ninja_cmd, *self.build_targets])
 
         if self.check_targets:
@@ -162,27 +226,22 @@ class LLVMBuilder(Builder):
                 install_targets = [f"install-{target}" for target in self.install_targets]
             else:
                 install_targets = ['install']
-            self.run_cmd([*base_ninja_cmd, *install_targets], capture_output=True)
+            # Installing prints a line for every file, which is not worth
+            # showing or holding in memory. Redirect the output to a log file
+            # in case it ever needs to be inspected.
+            install_log = Path(self.folders.build, 'install.log')
+            with install_log.open('w', encoding='utf-8') as log_file:
+                self.run_cmd(
+                    [*base_ninja_cmd, *install_targets], stdout=log_file, stderr=subprocess.STDOUT
+                )
             tc_build.utils.create_gitignore(self.folders.install)
 
     def can_use_perf(self):
-        # Make sure perf is in the environment
-        if shutil.which('perf'):
-            try:
-                perf_cmd = [
-                    'perf', 'record',
-                    '--branch-filter', 'any,u',
-                    '--event', 'cycles:u',
-                    '--output', '/dev/null',
-                    '--', 'sleep', '1',
-                ]  # yapf: disable
-                subprocess.run(perf_cmd, capture_output=True, check=True)
-            except subprocess.CalledProcessError:
-                pass  # Fallthrough to False below
-            else:
-                return True
-
-        return False
+        # The result of probing perf does not change during a run, so only
+        # probe it if it has not been done already.
+        if self.bolt_use_perf is None:
+            self.bolt_use_perf = can_use_perf()
+        return self.bolt_use_perf
 
     def check_dependencies(self):
         deps = ['cmake', 'curl', 'git', 'ninja']
@@ -216,14 +275,9 @@ class LLVMBuilder(Builder):
         if self.quiet_cmake:
             cmake_cmd.append('--log-level=NOTICE')
 
-        if self.ccache:
-            if shutil.which('ccache'):
-                self.cmake_defines['CMAKE_C_COMPILER_LAUNCHER'] = 'ccache'
-                self.cmake_defines['CMAKE_CXX_COMPILER_LAUNCHER'] = 'ccache'
-            else:
-                tc_build.utils.print_warning(
-                    'ccache requested but could not be found on your system, ignoring...'
-                )
+        if self.compiler_launcher:
+            self.cmake_defines['CMAKE_C_COMPILER_LAUNCHER'] = self.compiler_launcher
+            self.cmake_defines['CMAKE_CXX_COMPILER_LAUNCHER'] = self.compiler_launcher
 
         if self.tools.clang_tblgen:
             self.cmake_defines['CLANG_TABLEGEN'] = self.tools.clang_tblgen
@@ -298,8 +352,45 @@ class LLVMBuilder(Builder):
 
         cmake_cmd += [f'-D{key}={self.cmake_defines[key]}' for key in sorted(self.cmake_defines)]
 
+        configure_key = self.configure_key(cmake_cmd)
+        if self.incremental and self.is_configured(configure_key):
+            tc_build.utils.print_info(
+                f"{self.folders.build} is already configured, skipping cmake and reusing it..."
+            )
+            return
+
         self.clean_build_folder()
         self.run_cmd(cmake_cmd)
+        self.configure_stamp.write_text(configure_key, encoding='utf-8')
+
+    @property
+    def configure_stamp(self):
+        return Path(self.folders.build, '.tc_build_configure.sha256')
+
+    def configure_key(self, cmake_cmd):
+        key_parts = [
+            str(elem)
+            for elem in cmake_cmd
+            if not str(elem).startswith(f"-D{JOB_POOL_DEFINES_PREFIX}")
+        ]
+        # ninja does not know about files that cmake was pointed at, such as a
+        # freshly built compiler from the previous stage or a regenerated
+        # profile, so their modification times must invalidate the build
+        # folder as well.
+        files = [self.tools.cc, self.tools.cxx, self.cmake_defines.get('LLVM_PROFDATA_FILE')]
+        key_parts += [
+            f"{file}:{file.stat().st_mtime_ns}"
+            for file in files
+            if isinstance(file, Path) and file.exists()
+        ]
+        return hashlib.sha256('\0'.join(key_parts).encode('utf-8')).hexdigest()
+
+    def is_configured(self, configure_key):
+        if not Path(self.folders.build, 'build.ninja').exists():
+            return False
+        if not self.configure_stamp.exists():
+            return False
+        return self.configure_stamp.read_text(encoding='utf-8') == configure_key
 
     def host_target(self):
         uname_to_llvm = {
@@ -365,10 +456,9 @@ class LLVMBuilder(Builder):
                 continue
 
             if target not in all_targets:
-                # tuple() for shorter pretty printing versus instead of
-                # ('{"', '".join(all_targets)}')
+                # get_all_targets() returns a tuple, which pretty prints compactly
                 raise RuntimeError(
-                    f"Requested target ('{target}') was not found in LLVM_ALL_TARGETS {tuple(all_targets)}, check spelling?"
+                    f"Requested target ('{target}') was not found in LLVM_ALL_TARGETS {all_targets}, check spelling?"
                 )
 
 
@@ -601,7 +691,7 @@ class LLVMSourceManager:
 
         return targets
 
-    def download(self, ref, shallow=False):
+    def download(self, ref, shallow=False, partial=False):
         if self.repo.exists():
             return
 
@@ -612,6 +702,9 @@ class LLVMSourceManager:
             git_clone.append('--depth=1')
             if ref != 'main':
                 git_clone.append('--no-single-branch')
+        elif partial:
+            # Fetch all commits and trees but only the blobs that are needed
+            git_clone.append('--filter=blob:none')
         git_clone += ['https://github.com/llvm/llvm-project', self.repo]
 
         subprocess.run(git_clone, check=True)
@@ -1,9 +1,16 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import os
 import platform
+import shutil
+import subprocess
 import time
 from argparse import Namespace
 from pathlib import Path
 import sys
+from types import MappingProxyType
 import tc_build.utils
+from tc_build.builder import run_parallel
 from tc_build.kernel import KernelBuilder, LinuxSourceManager, LLVMKernelBuilder
 from tc_build.llvm import (
     LLVMBootstrapBuilder,
@@ -46,6 +53,7 @@ class LLVMStages:
         self.profiling_dir = build_folder / "profiling"
         self.cspgo_profiling_dir = build_folder / "cspgo_profiling"
         self.final_dir = build_folder / "final"
+        lsm_prepare: Future | None = None
         # Validate and prepare Linux source if doing BOLT or PGO with kernel benchmarks
         # Check for issues early, as these technologies are time consuming, so a user
         # might step away from the build once it looks like it has started
@@ -82,8 +90,12 @@ class LLVMStages:
                 lsm.tarball.local_location = lsm.location.with_name(f"{lsm.location.name}.tar.xz")
                 lsm.tarball.remote_checksum_name = 'sha256sums.asc'
 
+                # Download and extract the kernel source in the background
+                # while the LLVM source is downloaded and updated below.
                 tc_build.utils.print_header('Preparing Linux source for profiling runs')
-                lsm.prepare()
+                executor = ThreadPoolExecutor(max_workers=1)
+                lsm_prepare = executor.submit(lsm.prepare)
+                executor.shutdown(wait=False)
             self.lsm = lsm
 
         # Validate and configure LLVM source
@@ -94,17 +106,38 @@ class LLVMStages:
             llvm_folder = Path(src_folder, 'llvm-project')
 
         self.llvm_folder = llvm_folder
+        self.install_folder = Path(args.install_folder).resolve() if args.install_folder else None
         self.llvm_source = LLVMSourceManager(llvm_folder)
-        self.llvm_source.download(args.ref, args.shallow_clone)
+        self.llvm_source.download(args.ref, args.shallow_clone, partial=not args.full_history)
         if not (args.llvm_folder or args.no_update):
             self.llvm_source.update(args.ref)
 
+        # Surface any issues with the Linux source before building anything
+        if lsm_prepare is not None:
+            lsm_prepare.result()
+
         # Get host tools
         tc_build.utils.print_header('Checking CC and LD')
 
         self.host_tools = HostTools()
         self.host_tools.show_compiler_linker()
 
+        # Cache the output of builds with the host compiler, preferring sccache
+        # (which supports shared and remote caches via SCCACHE_DIR,
+        # SCCACHE_REDIS, etc. in the environment) over ccache, unless the user
+        # configured ccache specifically.
+        self.compiler_launcher = None
+        if not args.no_ccache:
+            wants_ccache = args.ccache_dir or args.ccache_size
+            if shutil.which('sccache') and not wants_ccache:
+                self.compiler_launcher = 'sccache'
+            elif shutil.which('ccache'):
+                self.compiler_launcher = 'ccache'
+            else:
+                tc_build.utils.print_warning(
+                    'ccache requested but neither sccache nor ccache could be found on your system, ignoring...'
+                )
+
         # '--full-toolchain' affects all stages aside from the bootstrap stage so cache
         # the class for all future initializations.
         self.def_llvm_builder_cls = LLVMBuilder if args.full_toolchain else LLVMSlimBuilder
@@ -112,6 +145,7 @@ class LLVMStages:
         # Instantiate final builder to validate user supplied targets ahead of time, so
         # that the user can correct the issue sooner rather than later.
         self.final = self.def_llvm_builder_cls()
+        self.final.bolt_use_perf = args.bolt_use_perf
         self.final.folders.source = llvm_folder
         if args.targets:
             self.final.targets = args.targets
@@ -132,8 +166,12 @@ class LLVMStages:
         # Warn the user of certain issues with BOLT and instrumentation
         if args.bolt and not self.final.can_use_perf():
             warned = False
-            has_4f158995b9cddae = Path(llvm_folder, 'bolt/lib/Passes/ValidateMemRefs.cpp').exists()
-            if args.pgo and not args.assertions and not has_4f158995b9cddae:
+            # Only look for commit 4f158995b9cddae in the source when it matters
+            if (
+                args.pgo
+                and not args.assertions
+                and not Path(llvm_folder, 'bolt/lib/Passes/ValidateMemRefs.cpp').exists()
+            ):
                 tc_build.utils.print_warning(
                     'Using BOLT in instrumentation mode with PGO and no assertions might result in a binary that crashes:'
                 )
@@ -151,7 +189,8 @@ class LLVMStages:
                     "Consider dropping '--bolt' if there are any failures during the BOLT stage."
                 )
                 warned = True
-            if warned:
+            # Give the user a chance to cancel, unless nobody is around to do so
+            if warned and not (args.no_warn_delay or os.environ.get('TC_BUILD_NO_WARN_DELAY')):
                 tc_build.utils.print_warning('Continuing in 5 seconds, hit Ctrl-C to cancel...')
                 time.sleep(5)
 
@@ -185,28 +224,77 @@ class LLVMStages:
     def bootstrap(self):
         bootstrap = LLVMBootstrapBuilder()
         bootstrap.build_targets = ['distribution']
-        bootstrap.ccache = not self.args.no_ccache
+        bootstrap.compiler_launcher = self.compiler_launcher
         self.configure_llvm_builder(bootstrap, self.bootstrap_dir)
         if self.args.bolt:
             bootstrap.projects.append('bolt')
         if self.args.pgo:
             bootstrap.projects.append('compiler-rt')
+        # Reuse the bootstrap compiler from a previous run if nothing that
+        # affects it changed, unless the user explicitly asked for it to be
+        # rebuilt.
+        bootstrap.incremental = self.args.stage != 'bootstrap'
 
         bootstrap.check_dependencies()
         bootstrap.configure()
+        if bootstrap.incremental and self.bootstrap_is_cached(bootstrap):
+            tc_build.utils.print_info('Bootstrap compiler is up to date, skipping build...')
+            return
         bootstrap.build()
 
+        if key := self.bootstrap_key(bootstrap):
+            self.bootstrap_manifest.write_text(key, encoding='utf-8')
+
+    @property
+    def bootstrap_manifest(self):
+        return self.bootstrap_dir / '.tcbuild-manifest'
+
+    def bootstrap_key(self, bootstrap: LLVMBootstrapBuilder):
+        # The bootstrap folder is only reused by configure() if it was
+        # configured with the same cmake command and host compiler, so its
+        # configure stamp covers everything but the state of the source. If
+        # the state of the source cannot be determined (such as a user
+        # supplied tree that is not a git repository), do not attempt to
+        # cache anything.
+        if not bootstrap.configure_stamp.exists():
+            return None
+        try:
+            source_state = [
+                self.llvm_source.git_capture(cmd)
+                for cmd in (['rev-parse', 'HEAD'], ['status', '--porcelain'], ['diff', 'HEAD'])
+            ]
+        except subprocess.CalledProcessError:
+            return None
+        key_input = '\0'.join(
+            [bootstrap.configure_stamp.read_text(encoding='utf-8'), *source_state]
+        )
+        return hashlib.blake2b(key_input.encode('utf-8')).hexdigest()
+
+    def bootstrap_is_cached(self, bootstrap: LLVMBootstrapBuilder):
+        if not (
+            Path(self.bootstrap_dir, 'bin/clang').exists() and self.bootstrap_manifest.exists()
+        ):
+            return False
+        return self.bootstrap_manifest.read_text(encoding='utf-8') == self.bootstrap_key(bootstrap)
+
+    # This only derives values from the command line arguments without
+    # touching the disk, so it is cheap enough to redo on every invocation
+    # (including resumed '--stage' runs) rather than caching its results.
     def update_defines(self):
         # If the user did not specify CMAKE_C_FLAGS or CMAKE_CXX_FLAGS, add them as empty
         # to paste stage 2 to ensure there are no environment issues (since CFLAGS and CXXFLAGS
         # are taken into account by cmake)
+        defines = dict(self.common_cmake_defines)
         c_flag_defines = ['CMAKE_C_FLAGS', 'CMAKE_CXX_FLAGS']
         for define in c_flag_defines:
-            if define not in self.common_cmake_defines:
-                self.common_cmake_defines[define] = ''
+            if define not in defines:
+                defines[define] = ''
         # The user's build type should be taken into account past the bootstrap compiler
         if self.args.build_type:
-            self.common_cmake_defines['CMAKE_BUILD_TYPE'] = self.args.build_type
+            defines['CMAKE_BUILD_TYPE'] = self.args.build_type
+        # These are copied into every builder from here on out, make sure none
+        # of them can accidentally modify the shared values.
+        self.common_cmake_defines = MappingProxyType(defines)
 
     def setup_instrumentation(self, cspgo: bool = False) -> LLVMInstrumentedBuilder:
         choices = (
@@ -220,6 +308,7 @@ class LLVMStages:
         instrumented.check_targets = self.args.check_targets if 'llvm' in self.args.pgo else []
         instrumentation_dir = self.cspgo_instrumentation_dir if cspgo else self.instrumentation_dir
         self.configure_llvm_builder(instrumented, instrumentation_dir, self.bootstrap_dir)
+        instrumented.incremental = True
 
         return instrumented
 
@@ -227,10 +316,22 @@ class LLVMStages:
     def instrumentation(self, cspgo: bool = False):
         self.instrumented = self.setup_instrumentation(cspgo=cspgo)
         self.instrumented.configure()
+        # The instrumented build folder may have been reused from a previous
+        # run, whose profiles should not end up in the new profile. This has
+        # to happen before building, as running the check targets with the
+        # instrumented binaries generates profiles as well.
+        profiles_path = self.instrumented.profiles_path
+        if profiles_path and profiles_path.exists():
+            for profile in profiles_path.glob('*.profraw'):
+                profile.unlink()
         self.instrumented.build()
 
     @build_stage("Generating PGO profiles")
     def profiling(self, cspgo: bool = False):
+        # When resuming with '--stage', the instrumented builder from the
+        # previous invocation is recreated. This only sets up a Python object
+        # describing the existing build folder (nothing is configured or
+        # built), so it is cheaper than persisting the builder to disk.
         instrumented = (
             self.instrumented if self.instrumented else self.setup_instrumentation(cspgo=cspgo)
         )
@@ -253,80 +354,95 @@ class LLVMStages:
                 llvm_builder.tools.llvm_tblgen = self.bootstrap_dir / 'bin/llvm-tblgen'
             pgo_builders.append(llvm_builder)
 
-        # If the user specified both a full and slim build of the same type, remove
-        # the full build and warn them.
-        pgo_targets = [s.replace('kernel-', '') for s in self.args.pgo if 'kernel-' in s]
-        for pgo_target in pgo_targets:
-            if 'slim' not in pgo_target:
+        # Map each requested kernel configuration target to whether or not it
+        # should be a slim build. If the user specified both a full and slim
+        # build of the same type, use the slim build and warn them.
+        pgo_configs: dict[str, bool] = {}
+        for benchmark in self.args.pgo:
+            if not benchmark.startswith('kernel-'):
                 continue
-            config_target = pgo_target.split('-')[0]
-            if config_target in pgo_targets:
+            config_target, _, variant = benchmark.replace('kernel-', '', 1).partition('-')
+            slim = variant == 'slim'
+            if pgo_configs.get(config_target, slim) != slim:
                 tc_build.utils.print_warning(
                     f"Both full and slim were specified for {config_target}, ignoring full..."
                 )
-                pgo_targets.remove(config_target)
+                slim = True
+            pgo_configs[config_target] = slim
 
-        if pgo_targets:
+        if pgo_configs:
             kernel_builder = LLVMKernelBuilder()
             kernel_builder.folders.build = Path(self.build_folder, 'linux')
             kernel_builder.folders.source = self.lsm.location if self.lsm else None
             kernel_builder.toolchain_prefix = instrumentation_dir
-            for item in pgo_targets:
-                pgo_target = item.split('-')
-
-                config_target = pgo_target[0]
-                # For BOLT or "slim" PGO, we limit the number of kernels we build for
-                # each mode:
-                #
-                # When using perf, building too many kernels will generate a gigantic
-                # perf profile. perf2bolt calls 'perf script', which will load the
-                # entire profile into memory, which could cause OOM for most machines
-                # and long processing times for the ones that can handle it for little
-                # extra gain.
-                #
-                # With BOLT instrumentation, we generate one profile file for each
-                # invocation of clang (PID) to avoid profiling just the driver, so
-                # building multiple kernels will generate a few hundred gigabytes of
-                # fdata files.
-                #
-                # Just do a native build if the host target is in the list of targets
-                # or the first target if not.
-                if len(pgo_target) == 2:  # slim
-                    if instrumented.host_target_is_enabled():
-                        llvm_targets = [instrumented.host_target()]
-                    else:
-                        llvm_targets = self.final.targets[0:1]
-                # full
-                elif 'all' in self.final.targets:
-                    llvm_targets = self.llvm_source.default_targets()
-                else:
-                    llvm_targets = self.final.targets
-
-                kernel_builder.matrix[config_target] = llvm_targets
+            # Each kernel build only scales to a certain number of CPUs, so
+            # build several at once on machines with a lot of them.
+            kernel_builder.parallel_builds = max(1, tc_build.utils.cpu_count() // 32)
+            # For BOLT or "slim" PGO, we limit the number of kernels we build for
+            # each mode:
+            #
+            # When using perf, building too many kernels will generate a gigantic
+            # perf profile. perf2bolt calls 'perf script', which will load the
+            # entire profile into memory, which could cause OOM for most machines
+            # and long processing times for the ones that can handle it for little
+            # extra gain.
+            #
+            # With BOLT instrumentation, we generate one profile file for each
+            # invocation of clang (PID) to avoid profiling just the driver, so
+            # building multiple kernels will generate a few hundred gigabytes of
+            # fdata files.
+            #
+            # Just do a native build if the host target is in the list of targets
+            # or the first target if not.
+            if instrumented.host_target_is_enabled():
+                slim_llvm_targets = [instrumented.host_target()]
+            else:
+                slim_llvm_targets = self.final.targets[0:1]
+            if 'all' in self.final.targets:
+                full_llvm_targets = self.llvm_source.default_targets()
+            else:
+                full_llvm_targets = self.final.targets
+
+            for config_target, slim in pgo_configs.items():
+                kernel_builder.matrix[config_target] = (
+                    slim_llvm_targets if slim else full_llvm_targets
+                )
 
             pgo_builders.append(kernel_builder)
 
-        for pgo_builder in pgo_builders:
-            if hasattr(pgo_builder, 'configure') and callable(pgo_builder.configure):
-                tc_build.utils.print_info('Building LLVM for profiling...')
-                pgo_builder.configure()
-            pgo_builder.build()
+        # The LLVM and kernel benchmarks do not depend on each other, so run
+        # them in parallel, splitting the available CPUs between them.
+        if len(pgo_builders) > 1:
+            build_jobs = max(1, tc_build.utils.cpu_count() // len(pgo_builders))
+            for pgo_builder in pgo_builders:
+                pgo_builder.build_jobs = build_jobs
+        run_parallel(self.run_pgo_builder, pgo_builders)
 
         instrumented.generate_profdata()
 
+    def run_pgo_builder(self, pgo_builder):
+        if hasattr(pgo_builder, 'configure') and callable(pgo_builder.configure):
+            tc_build.utils.print_info('Building LLVM for profiling...')
+            pgo_builder.configure()
+        pgo_builder.build()
+
     @build_stage("Building LLVM (final)")
     def final_step(self):
         final = self.final
         final.build_targets = self.args.build_targets
         final.check_targets = self.args.check_targets
-        final.folders.install = (
-            Path(self.args.install_folder).resolve() if self.args.install_folder else None
-        )
+        final.folders.install = self.install_folder
+        final.incremental = True
         final.install_targets = self.args.install_targets
         self.configure_llvm_builder(final, self.final_dir, self.bootstrap_dir)
 
-        if self.args.lto:
-            final.cmake_defines['LLVM_ENABLE_LTO'] = self.args.lto.capitalize()
+        # ThinLTO compounds with the gains from PGO for little extra build
+        # time, so enable it with PGO unless the user asked otherwise.
+        lto = self.args.lto
+        if not lto and self.args.pgo and not self.args.no_auto_lto:
+            lto = 'thin'
+        if lto:
+            final.cmake_defines['LLVM_ENABLE_LTO'] = lto.capitalize()
         if (
             self.args.pgo
             and self.instrumented is not None
@@ -340,7 +456,7 @@ class LLVMStages:
             # If we skipped bootstrapping, we need to check the dependencies now
             # and pass along certain user options
             final.check_dependencies()
-            final.ccache = not self.args.no_ccache
+            final.compiler_launcher = self.compiler_launcher
             final.tools = self.host_tools
 
             # If the user requested BOLT but did not specify it in their projects nor
@@ -352,8 +468,13 @@ class LLVMStages:
                 final.tools.merge_fdata = self.final_dir / 'bin/merge-fdata'
                 final.tools.perf2bolt = self.final_dir / 'bin/perf2bolt'
 
+        # BOLT has to profile the final (possibly PGO optimized) clang binary,
+        # as its profile refers to addresses within that exact binary. The PGO
+        # profiling runs above use the instrumented compiler, so their kernel
+        # builds cannot double as the BOLT training run.
         if self.args.bolt:
             final.bolt = True
+            final.force_bolt = self.args.force_bolt
             final.bolt_builder = LLVMKernelBuilder()
             final.bolt_builder.folders.build = Path(self.build_folder, 'linux')
             final.bolt_builder.folders.source = self.lsm.location if self.lsm else None
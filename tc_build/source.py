@@ -1,15 +1,13 @@
 #!/usr/bin/env python3
 
 import hashlib
+import mmap
 from pathlib import Path
 import re
 import subprocess
 
 import tc_build.utils
 
-# When doing verification, read 128MiB at a time
-BYTES_TO_READ = 131072
-
 
 class Tarball:
     def __init__(self):
@@ -46,22 +44,29 @@ class Tarball:
                 raise RuntimeError(f"Could not find checksum for {self.remote_tarball_name}?")
 
             if 'sha256' in self.remote_checksum_name:
-                file_hash = hashlib.sha256()
+                hash_name = 'sha256'
             elif 'sha512' in self.remote_checksum_name:
-                file_hash = hashlib.sha512()
+                hash_name = 'sha512'
             else:
                 raise RuntimeError(
                     f"No supported hashlib for {self.remote_checksum_name}, add support for it?"
                 )
             with self.local_location.open('rb') as file:
-                while data := file.read(BYTES_TO_READ):
-                    file_hash.update(data)
+                # Hash the whole file in C rather than feeding it to the hash
+                # object chunk by chunk from Python. hashlib.file_digest() is
+                # only available in Python 3.11+, map the file into memory
+                # and hash it in one call otherwise.
+                if hasattr(hashlib, 'file_digest'):
+                    file_hash = hashlib.file_digest(file, hash_name)
+                else:
+                    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                        file_hash = hashlib.new(hash_name, data)
 
             computed_checksum = file_hash.hexdigest()
             expected_checksum = match.groups()[0]
             if computed_checksum != expected_checksum:
                 raise RuntimeError(
-                    f"Computed checksum of {self.local_destination} ('{computed_checksum}') differs from expected checksum ('{expected_checksum}'), remove it and try again?"
+                    f"Computed checksum of {self.local_location} ('{computed_checksum}') differs from expected checksum ('{expected_checksum}'), remove it and try again?"
                 )
 
     def extract(self, extraction_location):
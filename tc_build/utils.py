@@ -1,9 +1,31 @@
 #!/usr/bin/env python3
 
+import hashlib
+import os
 import subprocess
 import sys
+import threading
 import time
 
+# Whether build commands should be spawned with close_fds=True. Python creates
+# file descriptors as non-inheritable (PEP 446), so callers that do not pass
+# any descriptors to their children explicitly may turn this off to skip
+# closing every possible descriptor in the child before exec.
+DEFAULT_CLOSE_FDS = True
+
+# Serializes output from builders that are run in parallel
+_print_lock = threading.Lock()
+
+
+def cpu_count():
+    # os.cpu_count() returns the number of CPUs in the system, not the number
+    # of CPUs this process is allowed to run on (taskset, cpusets in
+    # containers), which can result in overcommitting the machine.
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count()
+
 
 def create_gitignore(folder):
     folder.joinpath('.gitignore').write_text('*\n', encoding='utf-8')
@@ -17,14 +39,22 @@ def curl(url, capture_output=True, destination=None, text=True):
     return subprocess.run(curl_cmd, capture_output=capture_output, check=True, text=text).stdout
 
 
+def file_digest(path):
+    file_hash = hashlib.blake2b()
+    with path.open('rb') as file:
+        while data := file.read(1024 * 1024):
+            file_hash.update(data)
+    return file_hash.hexdigest()
+
+
 def flush_std_err_out():
     sys.stderr.flush()
     sys.stdout.flush()
 
 
 def get_duration(start_seconds, end_seconds=None):
-    if not end_seconds:
-        end_seconds = time.time()
+    if end_seconds is None:
+        end_seconds = time.perf_counter()
     seconds = int(end_seconds - start_seconds)
     days, seconds = divmod(seconds, 60 * 60 * 24)
     hours, seconds = divmod(seconds, 60 * 60)
@@ -52,7 +82,8 @@ def libc_is_musl():
 
 
 def print_color(color, string):
-    print(f"{color}{string}\033[0m", flush=True)
+    with _print_lock:
+        print(f"{color}{string}\033[0m", flush=True)
 
 
 def print_cyan(msg):
@@ -65,7 +96,8 @@ def print_header(string):
 
 
 def print_info(msg):
-    print(f"I: {msg}", flush=True)
+    with _print_lock:
+        print(f"I: {msg}", flush=True)
 
 
 def print_warning(msg):